@@ -2,30 +2,62 @@ from flask import Flask, render_template, request, jsonify, session, redirect, u
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_mail import Mail, Message
-from functools import wraps
+from celery import Celery
+from smtplib import SMTPException
+from functools import wraps, lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import secrets
-from datetime import datetime, timedelta
+import hashlib
+import json
+import orjson
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
 import os
+import sys
+from dateutil.parser import isoparse
 from dotenv import load_dotenv
 from supabase import create_client, Client
+from postgrest.exceptions import APIError
+import httpx
 from werkzeug.security import generate_password_hash, check_password_hash
-import pytz
-import random
-import string
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
+import redis
 
 # Load environment variables from .env file
 load_dotenv()
 
 app = Flask(__name__)
+# Accept /api/foo and /api/foo/ alike instead of answering with a 308 redirect
+app.url_map.strict_slashes = False
 
 # Security configurations
 app.secret_key = os.environ.get('SECRET_KEY', secrets.token_hex(32))
 app.config['SESSION_COOKIE_SECURE'] = os.environ.get('FLASK_ENV') == 'production'  # HTTPS only in production
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
-app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=4)
+app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=4)  # Student sessions expire 4 hours after login
+app.config['SESSION_REFRESH_EACH_REQUEST'] = False  # Keep the 4 hours absolute rather than sliding
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file upload
 
+# Key for the passcode lookup index; must stay stable, so it is separate from SECRET_KEY
+PASSCODE_PEPPER = os.environ.get('PASSCODE_PEPPER')
+
+# Columns the student/guest login paths need from the students table
+STUDENT_LOGIN_COLUMNS = 'id, name, student_id, passcode, passcode_lookup, device_token, class_id, team_id, access_expires_at'
+
+# Shared worker pool for parallel passcode hashing and concurrent Supabase reads
+executor = ThreadPoolExecutor()
+
+# Guests share the class name as their passcode, so it gets a cheaper pbkdf2 cost
+GUEST_PASSCODE_HASH_METHOD = 'pbkdf2:sha256:10000'
+
+# Teachers' evaluator records are never logged into; this value matches no passcode
+TEACHER_RECORD_PASSCODE = '!'
+
+# Teacher passwords are hashed with argon2id (64 MiB, 2 passes)
+password_hasher = PasswordHasher(time_cost=2, memory_cost=65536, parallelism=1)
+
 # Flask-Mail configuration
 app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
 app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
@@ -36,22 +68,52 @@ app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', 'norep
 
 mail = Mail(app)
 
+# Redis configuration (shared by all workers)
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+# Bounded pool so each worker holds a fixed number of sockets to Redis
+redis_pool = redis.BlockingConnectionPool.from_url(REDIS_URL, max_connections=10, timeout=5)
+redis_client = redis.Redis(connection_pool=redis_pool)
+
+# Verification codes expire after 10 minutes
+VERIFICATION_CODE_TTL = 600
+# Class names never change once created, so they can be cached for a while
+CLASS_NAME_CACHE_TTL = 3600
+# Class versions (student ETags) expire so a missed bump leaves data stale for at most 5 minutes
+CLASS_VERSION_TTL = 300
+
 # Rate limiting
 limiter = Limiter(
     app=app,
     key_func=get_remote_address,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://"
+    storage_uri=REDIS_URL,
+    storage_options={'connection_pool': redis_pool},
+    strategy="moving-window",
+    # A Redis outage falls back to per-worker in-memory limits instead of failing requests
+    in_memory_fallback_enabled=True
 )
 
+# Background task queue (reuses the Redis instance as broker)
+celery = Celery(app.import_name, broker=REDIS_URL)
+# Small dedicated email queue to stay under SMTP provider rate limits
+celery.conf.task_routes = {'send_verification_email': {'queue': 'email_queue'}}
+celery.conf.worker_concurrency = 2
+# Only queue emails when a worker is running (none can run on Vercel); otherwise send inline
+EMAIL_WORKER_ENABLED = os.environ.get('EMAIL_WORKER_ENABLED', '').lower() == 'true'
+
+# Security headers (built once, applied to every response)
+SECURITY_HEADERS = {
+    'X-Content-Type-Options': 'nosniff',
+    'X-Frame-Options': 'DENY',
+    'X-XSS-Protection': '1; mode=block'
+}
+if os.environ.get('FLASK_ENV') == 'production':
+    SECURITY_HEADERS['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
+
 # Security headers middleware
 @app.after_request
 def set_security_headers(response):
-    response.headers['X-Content-Type-Options'] = 'nosniff'
-    response.headers['X-Frame-Options'] = 'DENY'
-    response.headers['X-XSS-Protection'] = '1; mode=block'
-    if os.environ.get('FLASK_ENV') == 'production':
-        response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
+    response.headers.update(SECURITY_HEADERS)
     return response
 
 # Supabase configuration
@@ -62,10 +124,42 @@ SUPABASE_KEY = os.environ.get('SUPABASE_KEY')
 if not SUPABASE_URL or not SUPABASE_KEY:
     raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
 
+# PostgreSQL error code raised when a unique constraint rejects an insert
+UNIQUE_VIOLATION = '23505'
+# PostgreSQL error code of a plain RAISE EXCEPTION (used by the evaluation rules trigger)
+RAISE_EXCEPTION = 'P0001'
+
+# Keep-alive pool for Supabase HTTP calls (well under Supabase's connection cap)
+SUPABASE_HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10)
+SUPABASE_HTTP_TIMEOUT = 10.0
+# Connection attempts retried before a request fails (safe for writes: nothing was sent yet)
+SUPABASE_HTTP_RETRIES = 3
+
+def create_supabase_transport():
+    """Pooled HTTP/2 transport that retries failed connection attempts"""
+    return httpx.HTTPTransport(http2=True, limits=SUPABASE_HTTP_LIMITS, retries=SUPABASE_HTTP_RETRIES)
+
+def configure_supabase_http_pool(client):
+    """Replace the default PostgREST HTTP session with a pooled HTTP/2 client"""
+    try:
+        rest_session = client.postgrest.session
+        client.postgrest.session = httpx.Client(
+            base_url=rest_session.base_url,
+            headers=rest_session.headers,
+            transport=create_supabase_transport(),
+            timeout=SUPABASE_HTTP_TIMEOUT
+        )
+        rest_session.close()
+        # Auth is left on the library defaults: the app never calls supabase.auth
+    except AttributeError as e:
+        # Client internals changed; keep the library defaults
+        print(f"⚠️  Warning: Could not configure Supabase connection pool: {e}")
+
 # Initialize supabase with error handling
 supabase = None
 try:
     supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    configure_supabase_http_pool(supabase)
     print("✅ Supabase connected successfully")
 except Exception as e:
     print(f"⚠️  Warning: Could not connect to Supabase: {e}")
@@ -73,93 +167,57 @@ except Exception as e:
 
 
 # Timezone helper for US East Coast time
-EST = pytz.timezone('US/Eastern')
+EST = ZoneInfo('America/New_York')
+UTC = timezone.utc
 
 def get_est_now():
     """Get current time in US Eastern Time"""
     return datetime.now(EST)
 
-def parse_iso_datetime(date_str):
-    """Robust ISO 8601 datetime parser for Python 3.9"""
+def parse_iso_datetime(date_str, default_tz=EST):
+    """Parse an ISO 8601 datetime string into an aware datetime (naive values get default_tz)"""
     if not date_str:
         return None
-    try:
-        return datetime.fromisoformat(date_str)
-    except ValueError:
-        try:
-            # Handle Z suffix
-            if date_str.endswith('Z'):
-                date_str = date_str.replace('Z', '+00:00')
-            
-            # Handle variable microsecond precision
-            if '.' in date_str:
-                # Find where the timezone part starts
-                plus_idx = date_str.find('+')
-                minus_idx = date_str.rfind('-') # Be careful with date separators
-                
-                # Assuming ISO format YYYY-MM-DDTHH:MM:SS.mmmmmm+HH:MM
-                # The minus sign for timezone is after the T.
-                t_idx = date_str.find('T')
-                if t_idx != -1:
-                    minus_idx = date_str.find('-', t_idx)
-                
-                tz_idx = -1
-                if plus_idx != -1:
-                    tz_idx = plus_idx
-                elif minus_idx != -1:
-                    # Check if this minus is for timezone (usually 3 chars from end or 6 chars from end)
-                    # e.g. -05:00 (6 chars) or -0500 (5 chars)
-                    if len(date_str) - minus_idx <= 6:
-                        tz_idx = minus_idx
-                
-                if tz_idx != -1:
-                    main_part = date_str[:tz_idx]
-                    tz_part = date_str[tz_idx:]
-                    
-                    # Split main part to get microseconds
-                    if '.' in main_part:
-                        dt_part, us_part = main_part.split('.')
-                        # Pad to 6 digits
-                        if len(us_part) < 6:
-                            us_part = us_part.ljust(6, '0')
-                        elif len(us_part) > 6:
-                            us_part = us_part[:6]
-                        
-                        return datetime.fromisoformat(f"{dt_part}.{us_part}{tz_part}")
-            
-            raise
-        except Exception:
-            # If all else fails, try to return naive datetime if possible or re-raise
-            raise ValueError(f"Invalid isoformat string: {date_str}")
+    # Python 3.11+ fromisoformat handles every offset and precision we store
+    if sys.version_info >= (3, 11):
+        parsed = datetime.fromisoformat(date_str)
+    else:
+        parsed = isoparse(date_str)
+    # Naive timestamps are wall-clock time in default_tz (US Eastern for our own writes)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=default_tz)
 
+def seconds_until(expires_at_str):
+    """Seconds left before an ISO expiry timestamp (negative once it has passed)"""
+    return (parse_iso_datetime(expires_at_str) - get_est_now()).total_seconds()
+
+def is_expired(expires_at_str):
+    """Check whether an ISO expiry timestamp is in the past"""
+    return get_est_now() > parse_iso_datetime(expires_at_str)
+
+@lru_cache(maxsize=1024)
 def convert_utc_to_est(utc_time_str):
     """Convert UTC ISO string to EST string"""
+    if not utc_time_str:
+        return utc_time_str
     try:
-        # Parse UTC time
-        utc_time = parse_iso_datetime(utc_time_str)
+        # Parse UTC time; if no timezone info, assume UTC
+        utc_time = parse_iso_datetime(utc_time_str, default_tz=UTC)
         
         # Convert to EST
-        if utc_time.tzinfo is None:
-            # If no timezone info, assume UTC
-            utc_time = utc_time.replace(tzinfo=pytz.UTC)
-        
         est_time = utc_time.astimezone(EST)
         return est_time.isoformat()
-    except:
+    except (ValueError, TypeError):
+        # Not an ISO timestamp; store the value unchanged
         return utc_time_str
 
 def generate_verification_code():
     """Generate a 6-digit verification code"""
-    return ''.join(random.choices(string.digits, k=6))
+    return f"{secrets.randbelow(1000000):06d}"
 
-def send_verification_email(email, code):
-    """Send verification code via email"""
-    try:
-        if not app.config['MAIL_USERNAME'] or not app.config['MAIL_PASSWORD']:
-            # For development, just log the code
-            print(f"📧 Verification code for {email}: {code}")
-            return True
-        
+@celery.task(name='send_verification_email', autoretry_for=(SMTPException, ConnectionError, TimeoutError), retry_backoff=True, max_retries=5)
+def send_verification_email_task(email, code):
+    """Deliver a verification code email (runs on the Celery worker)"""
+    with app.app_context():
         msg = Message(
             'Peer Evaluation Platform - Verification Code',
             recipients=[email]
@@ -179,60 +237,41 @@ Best regards,
 Peer Evaluation Platform
 """
         mail.send(msg)
+
+def send_verification_email(email, code):
+    """Send verification code email, in the background when an email worker is running"""
+    try:
+        if not app.config['MAIL_USERNAME'] or not app.config['MAIL_PASSWORD']:
+            # For development, just log the code
+            print(f"📧 Verification code for {email}: {code}")
+            return True
+        
+        if EMAIL_WORKER_ENABLED:
+            send_verification_email_task.delay(email, code)
+        else:
+            # No worker to consume the queue; deliver within the request
+            send_verification_email_task(email, code)
         return True
     except Exception as e:
         print(f"❌ Error sending email: {e}")
         return False
 
-# Authentication decorators
-def teacher_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session or session.get('role') != 'teacher':
-            # Check if this is an API request
-            if request.path.startswith('/api/'):
-                return jsonify({'error': 'Unauthorized'}), 401
-            return redirect(url_for('login'))
-        return f(*args, **kwargs)
-    return decorated_function
-
-def student_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session or session.get('role') != 'student':
-            return jsonify({'error': 'Unauthorized'}), 401
-        
-        # Check if student session is still valid (4 hours)
-        if session.get('role') == 'student':
-            created_at = session.get('created_at')
-            if created_at:
-                created_time = parse_iso_datetime(created_at)
-                if created_time.tzinfo is None:
-                    created_time = pytz.timezone('US/Eastern').localize(created_time)
-                if get_est_now() - created_time > timedelta(hours=4):
-                    session.clear()
-                    return jsonify({'error': 'Session expired'}), 401
-        return f(*args, **kwargs)
-    return decorated_function
-
-def login_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            return jsonify({'error': 'Unauthorized'}), 401
-        
-        # Check if student session is still valid (4 hours)
-        if session.get('role') == 'student':
-            created_at = session.get('created_at')
-            if created_at:
-                created_time = parse_iso_datetime(created_at)
-                if created_time.tzinfo is None:
-                    created_time = pytz.timezone('US/Eastern').localize(created_time)
-                if get_est_now() - created_time > timedelta(hours=4):
-                    session.clear()
-                    return jsonify({'error': 'Session expired'}), 401
-        return f(*args, **kwargs)
-    return decorated_function
+# Authentication decorator
+def role_required(role=None):
+    """Require a logged-in user, optionally with the given role ('teacher' or 'student')"""
+    # Decided from the signed session cookie alone; no database lookup per request.
+    # The device token is only checked against the database at login.
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if 'user_id' not in session or (role and session.get('role') != role):
+                # Check if this is an API request
+                if request.path.startswith('/api/'):
+                    return jsonify({'error': 'Unauthorized'}), 401
+                return redirect(url_for('login'))
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
 
 # Routes
 @app.route('/')
@@ -242,7 +281,8 @@ def index():
             return redirect(url_for('teacher_dashboard'))
         elif session.get('role') == 'student':
             return redirect(url_for('student_dashboard'))
-    return redirect(url_for('login'))
+    # Serve the login page directly to save a redirect on first visit
+    return render_template('login.html')
 
 @app.route('/login', methods=['GET', 'POST'])
 @limiter.limit("10 per minute")
@@ -258,12 +298,12 @@ def login():
         try:
             # Check if this is teacher login (has email)
             if email:
-                response = supabase.table('teachers').select('*').eq('email', email).execute()
+                response = supabase.table('teachers').select('id, name, password').eq('email', email).execute()
                 
                 if response.data and len(response.data) > 0:
                     teacher = response.data[0]
                     # Verify password hash
-                    if check_password_hash(teacher['password'], password):
+                    if verify_teacher_password(teacher, password):
                         session['user_id'] = teacher['id']
                         session['role'] = 'teacher'
                         session['name'] = teacher['name']
@@ -275,40 +315,26 @@ def login():
             # Student login with name and passcode
             elif passcode and student_name:
                 # For student login, we need to search by name first, then verify passcode
-                student_response = supabase.table('students').select('*').eq('name', student_name).execute()
+                student_response = supabase.table('students').select(STUDENT_LOGIN_COLUMNS).eq('name', student_name).execute()
                 
                 if student_response.data and len(student_response.data) > 0:
                     # Find all matching students with correct passcode
-                    matching_students = []
-                    for student in student_response.data:
-                        if check_password_hash(student['passcode'], passcode):
-                            matching_students.append(student)
+                    matching_students = find_passcode_matches(student_response.data, passcode)
                     
                     if not matching_students:
                         return jsonify({'error': 'Invalid passcode'}), 401
                     
                     # If student is in multiple classes, return class list for selection
                     if len(matching_students) > 1:
-                        classes_info = []
-                        for student in matching_students:
-                            class_response = supabase.table('classes').select('id, name').eq('id', student['class_id']).execute()
-                            if class_response.data:
-                                classes_info.append({
-                                    'student_id': student['id'],
-                                    'class_id': student['class_id'],
-                                    'class_name': class_response.data[0]['name'],
-                                    'team_id': student['team_id']
-                                })
+                        classes_info = get_class_choices(matching_students)
                         return jsonify({'success': True, 'multiple_classes': True, 'classes': classes_info})
                     
                     # Single class - proceed with login
                     student = matching_students[0]
                     
                     # Check access expiration
-                    if student.get('access_expires_at'):
-                        expires_at = parse_iso_datetime(student['access_expires_at'])
-                        if get_est_now().replace(tzinfo=None) > expires_at.replace(tzinfo=None):
-                            return jsonify({'error': 'Access has expired'}), 401
+                    if student.get('access_expires_at') and is_expired(student['access_expires_at']):
+                        return jsonify({'error': 'Access has expired'}), 401
                     
                     # Check device token
                     if student.get('device_token'):
@@ -318,8 +344,10 @@ def login():
                     else:
                         # Lock to this device
                         new_device_token = secrets.token_urlsafe(32)
-                        supabase.table('students').update({'device_token': new_device_token}).eq('id', student['id']).execute()
-                        student['device_token'] = new_device_token
+                        student['device_token'] = claim_device_token(student['id'], new_device_token)
+                        if student['device_token'] != new_device_token:
+                            # Another device claimed this account first
+                            return jsonify({'error': 'Login restricted to the original device'}), 401
                     
                     # Create session for student
                     session['user_id'] = student['id']
@@ -327,7 +355,7 @@ def login():
                     session['name'] = student['name']
                     session['class_id'] = student['class_id']
                     session['team_id'] = student['team_id']
-                    session['created_at'] = get_est_now().isoformat()
+                    session.permanent = True
                     
                     response = jsonify({'success': True, 'redirect': url_for('student_dashboard')})
                     response.set_cookie('device_token', student['device_token'], max_age=31536000, httponly=True)
@@ -346,42 +374,26 @@ def login():
                     return jsonify({'error': 'Please provide a passcode'}), 400
                 
                 # Try to find an existing guest (added by teacher or previously created)
-                existing_students = supabase.table('students').select('*').eq('name', name).execute()
+                # Guests have student_id 'non-student' or empty ('""' is PostgREST's quoted empty string)
+                existing_guests = supabase.table('students').select(STUDENT_LOGIN_COLUMNS).eq('name', name).in_('student_id', ['non-student', '""']).execute()
                 
-                matching_guests = []
-                if existing_students.data:
-                    for student in existing_students.data:
-                        # Check if it's a guest (student_id is 'non-student' or empty)
-                        if student.get('student_id') in ['non-student', '']:
-                            # Check if passcode matches (hashed or preset 449922)
-                            if check_password_hash(student['passcode'], guest_passcode):
-                                matching_guests.append(student)
+                # Check if passcode matches (hashed or preset 449922)
+                matching_guests = find_passcode_matches(existing_guests.data or [], guest_passcode)
                 
                 if not matching_guests:
                     return jsonify({'error': 'Guest account not found or invalid passcode.'}), 401
                 
                 # If guest is in multiple classes, return class list for selection
                 if len(matching_guests) > 1:
-                    classes_info = []
-                    for student in matching_guests:
-                        class_response = supabase.table('classes').select('id, name').eq('id', student['class_id']).execute()
-                        if class_response.data:
-                            classes_info.append({
-                                'student_id': student['id'],
-                                'class_id': student['class_id'],
-                                'class_name': class_response.data[0]['name'],
-                                'team_id': student['team_id']
-                            })
+                    classes_info = get_class_choices(matching_guests)
                     return jsonify({'success': True, 'multiple_classes': True, 'classes': classes_info})
                 
                 # Single class - proceed with login
                 student = matching_guests[0]
                 
                 # Check access expiration
-                if student.get('access_expires_at'):
-                    expires_at = parse_iso_datetime(student['access_expires_at'])
-                    if get_est_now().replace(tzinfo=None) > expires_at.replace(tzinfo=None):
-                        return jsonify({'error': 'Access has expired'}), 401
+                if student.get('access_expires_at') and is_expired(student['access_expires_at']):
+                    return jsonify({'error': 'Access has expired'}), 401
                 
                 # Check device token
                 if student.get('device_token'):
@@ -391,8 +403,10 @@ def login():
                 else:
                     # Lock to this device
                     new_device_token = secrets.token_urlsafe(32)
-                    supabase.table('students').update({'device_token': new_device_token}).eq('id', student['id']).execute()
-                    student['device_token'] = new_device_token
+                    student['device_token'] = claim_device_token(student['id'], new_device_token)
+                    if student['device_token'] != new_device_token:
+                        # Another device claimed this account first
+                        return jsonify({'error': 'Login restricted to the original device'}), 401
 
                 # Found matching guest account
                 session['user_id'] = student['id']
@@ -400,7 +414,7 @@ def login():
                 session['name'] = student['name']
                 session['class_id'] = student['class_id']
                 session['team_id'] = student['team_id']
-                session['created_at'] = get_est_now().isoformat()
+                session.permanent = True
                 
                 response = jsonify({'success': True, 'redirect': url_for('student_dashboard')})
                 response.set_cookie('device_token', student['device_token'], max_age=31536000, httponly=True)
@@ -425,24 +439,21 @@ def select_class():
             return jsonify({'error': 'Invalid request'}), 400
         
         # Get student info
-        student_response = supabase.table('students').select('*').eq('id', student_id).execute()
+        student_response = supabase.table('students').select('id, name, access_expires_at, device_token').eq('id', student_id).execute()
         if not student_response.data:
             return jsonify({'error': 'Student not found'}), 404
         
         student = student_response.data[0]
         
         # Check access expiration only
-        if student.get('access_expires_at'):
-            expires_at = parse_iso_datetime(student['access_expires_at'])
-            if get_est_now().replace(tzinfo=None) > expires_at.replace(tzinfo=None):
-                return jsonify({'error': 'Access has expired'}), 401
+        if student.get('access_expires_at') and is_expired(student['access_expires_at']):
+            return jsonify({'error': 'Access has expired'}), 401
         
         # Device token was already verified during initial login
         # Just use the existing token or set one if not present
         device_token = student.get('device_token')
         if not device_token:
-            device_token = secrets.token_urlsafe(32)
-            supabase.table('students').update({'device_token': device_token}).eq('id', student['id']).execute()
+            device_token = claim_device_token(student['id'], secrets.token_urlsafe(32))
         
         # Create session
         session['user_id'] = student['id']
@@ -450,7 +461,7 @@ def select_class():
         session['name'] = student['name']
         session['class_id'] = class_id
         session['team_id'] = team_id
-        session['created_at'] = get_est_now().isoformat()
+        session.permanent = True
         
         response = jsonify({'success': True, 'redirect': url_for('student_dashboard')})
         response.set_cookie('device_token', device_token, max_age=31536000, httponly=True)
@@ -481,14 +492,12 @@ def register():
             except Exception as e:
                 return jsonify({'error': 'Database error'}), 500
             
-            # Generate and store verification code
+            # Generate and store verification code (expires automatically in Redis)
             code = generate_verification_code()
-            expiry = (get_est_now() + timedelta(minutes=10)).isoformat()
-            
-            # Store code in session (temporary storage)
-            session['verification_code'] = code
-            session['verification_email'] = email
-            session['verification_expiry'] = expiry
+            try:
+                redis_client.setex(f"verif:{email}", VERIFICATION_CODE_TTL, code)
+            except redis.RedisError as e:
+                return jsonify({'error': 'Failed to store verification code'}), 500
             
             # Send verification email
             if send_verification_email(email, code):
@@ -508,30 +517,20 @@ def register():
                 return jsonify({'error': 'Only @monmouth.edu email addresses are allowed'}), 400
             
             # Verify code
-            stored_code = session.get('verification_code')
-            stored_email = session.get('verification_email')
-            stored_expiry = session.get('verification_expiry')
-            
-            if not stored_code or not stored_email or not stored_expiry:
-                return jsonify({'error': 'No verification code found. Please request a new one.'}), 400
+            try:
+                stored_code = redis_client.get(f"verif:{email}")
+            except redis.RedisError as e:
+                return jsonify({'error': 'Failed to read verification code'}), 500
             
-            if email != stored_email:
-                return jsonify({'error': 'Email does not match verification request'}), 400
+            if stored_code is None:
+                return jsonify({'error': 'No valid verification code found. Please request a new one.'}), 400
             
-            if code != stored_code:
+            if code != stored_code.decode():
                 return jsonify({'error': 'Invalid verification code'}), 400
             
-            # Check if code expired
-            expiry_time = parse_iso_datetime(stored_expiry)
-            if get_est_now() > expiry_time:
-                session.pop('verification_code', None)
-                session.pop('verification_email', None)
-                session.pop('verification_expiry', None)
-                return jsonify({'error': 'Verification code has expired. Please request a new one.'}), 400
-            
             try:
-                # Hash the password before storing using pbkdf2 (compatible with Python 3.9)
-                hashed_password = generate_password_hash(password, method='pbkdf2')
+                # Hash the password before storing
+                hashed_password = password_hasher.hash(password)
                 
                 response = supabase.table('teachers').insert({
                     'name': name,
@@ -540,10 +539,8 @@ def register():
                     'created_at': get_est_now().isoformat()
                 }).execute()
                 
-                # Clear verification data from session
-                session.pop('verification_code', None)
-                session.pop('verification_email', None)
-                session.pop('verification_expiry', None)
+                # Verification code is single-use
+                redis_client.delete(f"verif:{email}")
                 
                 return jsonify({'success': True, 'redirect': url_for('login')})
             except Exception as e:
@@ -560,18 +557,18 @@ def logout():
     return redirect(url_for('login'))
 
 @app.route('/teacher/dashboard')
-@teacher_required
+@role_required('teacher')
 def teacher_dashboard():
     return render_template('teacher_dashboard.html')
 
 @app.route('/student/dashboard')
-@student_required
+@role_required('student')
 def student_dashboard():
     return render_template('student_dashboard.html')
 
 # API Routes for Classes
 @app.route('/api/classes', methods=['GET', 'POST'])
-@teacher_required
+@role_required('teacher')
 def manage_classes():
     if request.method == 'POST':
         data = request.get_json()
@@ -579,10 +576,11 @@ def manage_classes():
         
         try:
             # Create class using EST time
+            now_iso = get_est_now().isoformat()
             class_response = supabase.table('classes').insert({
                 'name': class_name,
                 'teacher_id': session['user_id'],
-                'created_at': get_est_now().isoformat()
+                'created_at': now_iso
             }).execute()
             
             if not class_response.data or len(class_response.data) == 0:
@@ -594,7 +592,7 @@ def manage_classes():
             supabase.table('teams').insert({
                 'name': 'Guests',
                 'class_id': class_id,
-                'created_at': get_est_now().isoformat()
+                'created_at': now_iso
             }).execute()
             
             return jsonify({'success': True, 'class': class_response.data[0]})
@@ -615,18 +613,14 @@ def manage_classes():
             return jsonify({'error': f'Failed to load classes: {str(e)}'}), 500
 
 @app.route('/api/classes/<int:class_id>/teams', methods=['GET', 'POST'])
-@teacher_required
+@role_required('teacher')
 def manage_teams(class_id):
     if request.method == 'POST':
         data = request.get_json()
         team_name = data.get('team_name')
         
         try:
-            # Check if team name already exists in this class
-            existing_team = supabase.table('teams').select('*').eq('class_id', class_id).eq('name', team_name).execute()
-            if existing_team.data:
-                return jsonify({'error': f'Team "{team_name}" already exists in this class'}), 400
-
+            # Duplicate names are rejected by the teams_class_name_unique constraint
             response = supabase.table('teams').insert({
                 'name': team_name,
                 'class_id': class_id,
@@ -634,11 +628,16 @@ def manage_teams(class_id):
             }).execute()
             
             new_team = response.data[0]
+            bump_class_version(class_id)
             
             # No longer creating default Placeholder member
             # Teams can now exist with no members
             
             return jsonify({'success': True, 'team': new_team})
+        except APIError as e:
+            if e.code == UNIQUE_VIOLATION:
+                return jsonify({'error': f'Team "{team_name}" already exists in this class'}), 400
+            return jsonify({'error': str(e)}), 500
         except Exception as e:
             return jsonify({'error': str(e)}), 500
     
@@ -651,19 +650,18 @@ def manage_teams(class_id):
             return jsonify({'error': str(e)}), 500
 
 @app.route('/api/classes/<int:class_id>/teams/<int:team_id>/members')
-@teacher_required
+@role_required('teacher')
 def get_team_members(class_id, team_id):
     try:
         # Get all students in this team
-        response = supabase.table('students').select('*').eq('team_id', team_id).eq('class_id', class_id).execute()
-        # Remove passcode from response for security
-        members = [{'id': s['id'], 'name': s['name'], 'student_id': s.get('student_id')} for s in response.data]
-        return jsonify({'members': members})
+        # Only public columns (never the passcode hash)
+        response = supabase.table('students').select('id, name, student_id').eq('team_id', team_id).eq('class_id', class_id).execute()
+        return jsonify({'members': response.data})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/classes/<int:class_id>/teams/<int:team_id>', methods=['DELETE'])
-@teacher_required
+@role_required('teacher')
 def delete_team(class_id, team_id):
     try:
         # Verify team belongs to this class
@@ -676,25 +674,25 @@ def delete_team(class_id, team_id):
         
         # Delete the team
         supabase.table('teams').delete().eq('id', team_id).execute()
+        bump_class_version(class_id)
         
         return jsonify({'success': True, 'message': 'Team deleted successfully'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/classes/<int:class_id>/students')
-@teacher_required
+@role_required('teacher')
 def get_class_students(class_id):
     try:
         # Get all students in this class
-        response = supabase.table('students').select('*').eq('class_id', class_id).execute()
-        # Remove passcode from response for security
-        students = [{'id': s['id'], 'name': s['name'], 'student_id': s.get('student_id'), 'team_id': s.get('team_id')} for s in response.data]
-        return jsonify({'students': students})
+        # Only public columns (never the passcode hash)
+        response = supabase.table('students').select('id, name, student_id, team_id').eq('class_id', class_id).execute()
+        return jsonify({'students': response.data})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/classes/<int:class_id>/assignments', methods=['GET', 'POST'])
-@teacher_required
+@role_required('teacher')
 def manage_assignments(class_id):
     if request.method == 'POST':
         data = request.get_json()
@@ -707,6 +705,7 @@ def manage_assignments(class_id):
                 'end_time': convert_utc_to_est(data.get('end_time')),
                 'created_at': get_est_now().isoformat()
             }).execute()
+            bump_class_version(class_id)
             
             return jsonify({'success': True, 'assignment': response.data[0]})
         except Exception as e:
@@ -720,11 +719,13 @@ def manage_assignments(class_id):
             return jsonify({'error': str(e)}), 500
 
 @app.route('/api/assignments/<int:assignment_id>', methods=['PUT', 'DELETE'])
-@teacher_required
+@role_required('teacher')
 def update_assignment(assignment_id):
     if request.method == 'DELETE':
         try:
-            supabase.table('assignments').delete().eq('id', assignment_id).execute()
+            response = supabase.table('assignments').delete().eq('id', assignment_id).execute()
+            if response.data:
+                bump_class_version(response.data[0]['class_id'])
             return jsonify({'success': True})
         except Exception as e:
             return jsonify({'error': str(e)}), 500
@@ -737,13 +738,14 @@ def update_assignment(assignment_id):
             'start_time': convert_utc_to_est(data.get('start_time')),
             'end_time': convert_utc_to_est(data.get('end_time'))
         }).eq('id', assignment_id).execute()
+        bump_class_version(response.data[0]['class_id'])
         
         return jsonify({'success': True, 'assignment': response.data[0]})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/classes/<int:class_id>/access-link', methods=['POST'])
-@teacher_required
+@role_required('teacher')
 def generate_access_link(class_id):
     try:
         data = request.get_json() or {}
@@ -759,13 +761,14 @@ def generate_access_link(class_id):
         
         token = secrets.token_urlsafe(32)
         # Link expires in specified hours (default 2 hours)
-        expires_at = get_est_now() + timedelta(hours=hours)
+        now = get_est_now()
+        expires_at = now + timedelta(hours=hours)
         
         supabase.table('access_tokens').insert({
             'token': token,
             'class_id': class_id,
             'expires_at': expires_at.isoformat(),
-            'created_at': get_est_now().isoformat()
+            'created_at': now.isoformat()
         }).execute()
         
         link = url_for('join_class', token=token, _external=True)
@@ -774,7 +777,7 @@ def generate_access_link(class_id):
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/teams/<int:team_id>/add-students', methods=['POST'])
-@teacher_required
+@role_required('teacher')
 def add_students_to_team(team_id):
     """Teacher inputs text with student list. Format depends on team type:
     - Regular teams: 'Full Name StudentID' per line (e.g., 'Mike Lee S123456')
@@ -784,7 +787,6 @@ def add_students_to_team(team_id):
     text_input = data.get('text', '').strip()  # Multi-line text input
     
     try:
-        added_students = []
         lines = [line.strip() for line in text_input.split('\n') if line.strip()]
         
         # Get team to find class_id and team name
@@ -796,60 +798,59 @@ def add_students_to_team(team_id):
         # Get class name for guest passcode
         class_name = ''
         if is_guest_team:
-            class_response = supabase.table('classes').select('name').eq('id', class_id).single().execute()
-            class_name = class_response.data['name']
+            class_name = get_class_name(class_id)
+        
+        # Load the team's names once so duplicates are resolved in memory
+        existing = supabase.table('students').select('name').eq('team_id', team_id).execute()
+        existing_names = {s['name'] for s in existing.data}
         
+        # Every row in the paste shares the submission timestamp
+        now_iso = get_est_now().isoformat()
+        rows = []
+        passcodes = []
+        # Guests share the class name as passcode, so their rows get the cheaper method
+        passcode_method = GUEST_PASSCODE_HASH_METHOD if is_guest_team else 'pbkdf2'
         for line in lines:
             if is_guest_team:
                 # For Guests team, just use the full line as name
-                name = line.strip()
-                # Ensure unique name
-                name = get_unique_student_name(name, team_id)
-                
+                # Guests use the class name as passcode
+                name = line
                 student_id = 'non-student'
-                
-                # Create guest student account with class name as passcode
-                student_data = {
-                    'name': name,
-                    'team_id': team_id,
-                    'class_id': class_id,
-                    'student_id': 'non-student',
-                    'passcode': generate_password_hash(class_name, method='pbkdf2'),
-                    'is_pre_added': False,
-                    'created_at': get_est_now().isoformat()
-                }
-                
-                response = supabase.table('students').insert(student_data).execute()
-                added_students.append({'name': name, 'student_id': 'non-student'})
+                passcode = class_name
+                is_pre_added = False
             else:
                 # For regular teams, parse "Full Name StudentID" format
                 parts = line.rsplit(' ', 1)
-                if len(parts) == 2:
-                    name = parts[0].strip()
-                    # Ensure unique name
-                    name = get_unique_student_name(name, team_id)
-                    
-                    student_id = parts[1].strip()
-                    
-                    # Create student with available fields only
-                    student_data = {
-                        'name': name,
-                        'team_id': team_id,
-                        'class_id': class_id,
-                        'created_at': get_est_now().isoformat()
-                    }
-                    
-                    # Try to add optional fields if they exist
-                    try:
-                        student_data['student_id'] = student_id
-                        student_data['passcode'] = generate_password_hash(student_id, method='pbkdf2')  # Hash the passcode
-                        student_data['is_pre_added'] = True
-                    except:
-                        pass
-                    
-                    response = supabase.table('students').insert(student_data).execute()
-                    added_students.append({'name': name, 'student_id': student_id})
+                if len(parts) != 2:
+                    continue
+                name = parts[0].strip()
+                student_id = parts[1].strip()
+                passcode = student_id
+                is_pre_added = True
+            
+            rows.append({
+                # Ensure unique name, also across names added earlier in this batch
+                'name': get_unique_student_name(name, existing_names),
+                'team_id': team_id,
+                'class_id': class_id,
+                'student_id': student_id,
+                'passcode_lookup': get_passcode_lookup(passcode),
+                'is_pre_added': is_pre_added,
+                'created_at': now_iso
+            })
+            passcodes.append(passcode)
+        
+        # Hash passcodes in parallel (pbkdf2 runs in C and releases the GIL)
+        hashes = executor.map(lambda passcode: generate_password_hash(passcode, method=passcode_method), passcodes)
+        for row, passcode_hash in zip(rows, hashes):
+            row['passcode'] = passcode_hash
         
+        # Insert the whole roster in one request
+        if rows:
+            supabase.table('students').insert(rows).execute()
+            bump_class_version(class_id)
+        
+        added_students = [{'name': row['name'], 'student_id': row['student_id']} for row in rows]
         return jsonify({'success': True, 'added': added_students})
     except Exception as e:
         print(f"ERROR adding students: {str(e)}")
@@ -868,111 +869,87 @@ def join_class(token):
         
         try:
             # Verify token
-            token_response = supabase.table('access_tokens').select('*').eq('token', token).execute()
+            token_data = get_access_token(token)
             
-            if not token_response.data or len(token_response.data) == 0:
+            if not token_data:
                 return jsonify({'error': 'Invalid token'}), 400
             
-            token_data = token_response.data[0]
-            expires_at = parse_iso_datetime(token_data['expires_at'])
+            expires_at = token_data['expires_at']
             
-            # Check if token expired (using EST time)
-            if get_est_now().replace(tzinfo=None) > expires_at.replace(tzinfo=None):
+            # Check if token expired
+            if is_expired(expires_at):
                 return jsonify({'error': 'Token expired'}), 400
             
             class_id = token_data['class_id']
             
             # Generate device token for this session
             device_token = secrets.token_urlsafe(32)
+            now_iso = get_est_now().isoformat()
             
             # Guest join
             if is_guest:
                 # Get class name for guest passcode
-                class_response = supabase.table('classes').select('name').eq('id', class_id).execute()
-                class_name = class_response.data[0]['name'] if class_response.data else 'Guest'
+                class_name = get_class_name(class_id) or 'Guest'
                 
                 # Get or create the "Guests" team for this class
-                guests_team_response = supabase.table('teams').select('*').eq('class_id', class_id).eq('name', 'Guests').execute()
+                guests_team_response = supabase.table('teams').select('id').eq('class_id', class_id).eq('name', 'Guests').limit(1).maybe_single().execute()
                 
-                if guests_team_response.data and len(guests_team_response.data) > 0:
-                    guests_team = guests_team_response.data[0]
+                if guests_team_response:
+                    guests_team = guests_team_response.data
                 else:
                     # Create "Guests" team if it doesn't exist
                     team_response = supabase.table('teams').insert({
                         'name': 'Guests',
                         'class_id': class_id,
-                        'created_at': get_est_now().isoformat()
+                        'created_at': now_iso
                     }).execute()
                     guests_team = team_response.data[0]
                 
-                # Check if student with this exact name already exists in this team
-                existing_student_response = supabase.table('students').select('*').eq('name', student_name).eq('team_id', guests_team['id']).execute()
-                
-                if existing_student_response.data and len(existing_student_response.data) > 0:
-                    # Student with this name already exists - log them in directly
-                    student = existing_student_response.data[0]
-                    # Update their access expiration and device token
-                    supabase.table('students').update({
-                        'access_expires_at': expires_at.isoformat(),
-                        'device_token': device_token
-                    }).eq('id', student['id']).execute()
-                    student['device_token'] = device_token
-                else:
-                    # New guest - create account
-                    student_response = supabase.table('students').insert({
-                        'name': student_name,
-                        'student_id': '',  # No student ID for guests
-                        'passcode': generate_password_hash(class_name, method='pbkdf2'),  # Hash the class name as passcode
-                        'team_id': guests_team['id'],
-                        'class_id': class_id,
-                        'is_pre_added': False,
-                        'access_expires_at': expires_at.isoformat(), # Set access expiration
-                        'device_token': device_token, # Set device token
-                        'created_at': get_est_now().isoformat()
-                    }).execute()
-                    
-                    student = student_response.data[0]
                 team_id = guests_team['id']
+                # Guests have no student ID and share the class name as passcode
+                new_student_id = ''
+                passcode = class_name
+                passcode_method = GUEST_PASSCODE_HASH_METHOD
             else:
-                # Student join
-                # First check if student with this name already exists in this team
-                existing_student_response = supabase.table('students').select('*').eq('name', student_name).eq('team_id', team_id).execute()
-                
-                if existing_student_response.data and len(existing_student_response.data) > 0:
-                    # Student with this name already exists - log them in directly
-                    student = existing_student_response.data[0]
-                    # Update their access expiration and device token
-                    supabase.table('students').update({
-                        'access_expires_at': expires_at.isoformat(),
-                        'device_token': device_token
-                    }).eq('id', student['id']).execute()
-                    student['device_token'] = device_token
-                else:
-                    # Check if student was pre-added by teacher
-                    pre_added_response = supabase.table('students').select('*').eq('student_id', student_id).eq('team_id', team_id).eq('is_pre_added', True).execute()
-                    
-                    if pre_added_response.data and len(pre_added_response.data) > 0:
-                        # Student was pre-added by teacher, update their name
-                        student = pre_added_response.data[0]
-                        supabase.table('students').update({
-                            'name': student_name,
-                            'access_expires_at': expires_at.isoformat(),
-                            'device_token': device_token
-                        }).eq('id', student['id']).execute()
-                    else:
-                        # New student: create account with SID as passcode
-                        student_response = supabase.table('students').insert({
-                            'name': student_name,
-                            'student_id': student_id,
-                            'passcode': generate_password_hash(student_id, method='pbkdf2'),  # Hash the student ID used as passcode
-                            'team_id': team_id,
-                            'class_id': class_id,
-                            'is_pre_added': False,
-                            'access_expires_at': expires_at.isoformat(), # Set access expiration
-                            'device_token': device_token, # Set device token
-                            'created_at': get_est_now().isoformat()
-                        }).execute()
-                        student = student_response.data[0]
+                # Students use their SID as passcode
+                new_student_id = student_id
+                passcode = student_id
+                passcode_method = 'pbkdf2'
+            
+            # First check if student with this name already exists in this team
+            student_response = supabase.table('students').select('id, name').eq('name', student_name).eq('team_id', team_id).limit(1).maybe_single().execute()
+            if not student_response and not is_guest:
+                # Check if student was pre-added by teacher
+                student_response = supabase.table('students').select('id, name').eq('student_id', student_id).eq('team_id', team_id).eq('is_pre_added', True).limit(1).maybe_single().execute()
+            
+            if student_response:
+                # Existing or pre-added student - log them in directly
+                # (a pre-added record also takes the name they entered)
+                student = student_response.data
+                student['name'] = student_name
+                supabase.table('students').update({
+                    'name': student_name,
+                    'access_expires_at': expires_at,
+                    'device_token': device_token
+                }).eq('id', student['id']).execute()
+            else:
+                # New student or guest - create account
+                student_response = supabase.table('students').insert({
+                    'name': student_name,
+                    'student_id': new_student_id,
+                    'passcode': generate_password_hash(passcode, method=passcode_method),
+                    'passcode_lookup': get_passcode_lookup(passcode),
+                    'team_id': team_id,
+                    'class_id': class_id,
+                    'is_pre_added': False,
+                    'access_expires_at': expires_at, # Set access expiration
+                    'device_token': device_token, # Set device token
+                    'created_at': now_iso
+                }).execute()
+                student = student_response.data[0]
+            
+            # A new or renamed member changes the class's team listing
+            bump_class_version(class_id)
             
             # Create session
             session['user_id'] = student['id']
@@ -980,7 +957,7 @@ def join_class(token):
             session['name'] = student['name']
             session['class_id'] = class_id
             session['team_id'] = team_id
-            session['created_at'] = get_est_now().isoformat()
+            session.permanent = True
             
             response = jsonify({'success': True, 'redirect': url_for('student_dashboard')})
             # Set device token cookie (valid for 1 year)
@@ -992,16 +969,13 @@ def join_class(token):
     else:  # GET
         try:
             # Verify token
-            token_response = supabase.table('access_tokens').select('*').eq('token', token).execute()
+            token_data = get_access_token(token)
             
-            if not token_response.data or len(token_response.data) == 0:
+            if not token_data:
                 return render_template('error.html', message='Invalid access link')
             
-            token_data = token_response.data[0]
-            expires_at = parse_iso_datetime(token_data['expires_at'])
-            
-            # Check expiration using EST time
-            if get_est_now().replace(tzinfo=None) > expires_at.replace(tzinfo=None):
+            # Check expiration (re-checked on every hit, including cached tokens)
+            if is_expired(token_data['expires_at']):
                 return render_template('error.html', message='Access link has expired')
             
             # Get teams for the class
@@ -1012,46 +986,55 @@ def join_class(token):
             return render_template('error.html', message=str(e))
 
 @app.route('/api/student/assignments')
-@student_required
+@role_required('student')
 def get_student_assignments():
     try:
         class_id = session.get('class_id')
         
+        # Answer polling dashboards with 304 until the class changes, before touching Supabase
+        etag = class_etag('assignments', class_id)
+        if etag is not None and etag in request.if_none_match:
+            return with_etag(app.response_class(status=304), etag)
+        
         response = supabase.table('assignments').select('*').eq('class_id', class_id).order('start_time', desc=False).execute()
         
         # Return all assignments sorted by start_time (upcoming first)
-        return jsonify({'assignments': response.data})
+        return with_etag(jsonify({'assignments': response.data}), etag)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/student/teams')
-@student_required
+@role_required('student')
 def get_student_teams():
     try:
         class_id = session.get('class_id')
         
+        # The response includes my_team_id, so it is part of the ETag
+        etag = class_etag('teams', class_id, session.get('team_id'))
+        if etag is not None and etag in request.if_none_match:
+            return with_etag(app.response_class(status=304), etag)
+        
         # Fetch teams, excluding 'Guests' and 'Teachers'
-        response = supabase.table('teams').select('*, students(*)').eq('class_id', class_id).neq('name', 'Guests').neq('name', 'Teachers').execute()
+        # Only the fields the dashboard renders; student_id is a classmate's passcode, so never send it
+        response = supabase.table('teams').select('id, name, students(id, name)').eq('class_id', class_id).neq('name', 'Guests').neq('name', 'Teachers').execute()
         
         # No longer filtering out Placeholder - teams can have any members or be empty
         teams_data = response.data
         
-        return jsonify({'teams': teams_data, 'my_team_id': session.get('team_id')})
+        return with_etag(jsonify({'teams': teams_data, 'my_team_id': session.get('team_id')}), etag)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/evaluations', methods=['POST'])
-@login_required
+@role_required()
 def submit_evaluation():
     data = request.get_json()
     evaluated_team_id = data.get('evaluated_team_id')
     
     try:
-        # Check if evaluating Guests team
-        evaluated_team = supabase.table('teams').select('*').eq('id', evaluated_team_id).single().execute()
-        if evaluated_team.data and evaluated_team.data['name'] == 'Guests':
-             return jsonify({'error': 'Cannot evaluate the Guests group'}), 403
-
+        # The Guests and own-team rules are enforced by a trigger on team_evaluations
+        # (see migrations/add_team_evaluations_rules.sql)
+        
         # Determine evaluator ID
         if session.get('role') == 'teacher':
             # Get assignment to find class_id
@@ -1067,118 +1050,89 @@ def submit_evaluation():
             if str(session.get('team_id')) == str(evaluated_team_id):
                 return jsonify({'error': 'You cannot evaluate your own team'}), 403
 
-        # Check for existing evaluation and delete it if it exists (replacement logic)
-        existing = supabase.table('team_evaluations').select('id').eq('assignment_id', data.get('assignment_id')).eq('evaluated_team_id', data.get('evaluated_team_id')).eq('evaluator_student_id', evaluator_id).execute()
+        # Replace any existing evaluation and store the new team and member
+        # evaluations in one transaction (see add_replace_evaluation_function.sql)
+        # No longer skipping any students - all can be evaluated
+        member_evaluations = [{
+            'student_id': member_eval.get('student_id'),
+            'comment': member_eval.get('comment'),
+            'score': member_eval.get('score')
+        } for member_eval in data.get('member_evaluations', [])]
         
-        if existing.data:
-            # Delete existing evaluation
-            for eval_record in existing.data:
-                # First delete member evaluations linked to this team evaluation
-                supabase.table('member_evaluations').delete().eq('team_evaluation_id', eval_record['id']).execute()
-                # Then delete the team evaluation
-                supabase.table('team_evaluations').delete().eq('id', eval_record['id']).execute()
-
-        # Store team evaluation
-        team_eval = supabase.table('team_evaluations').insert({
-            'assignment_id': data.get('assignment_id'),
-            'evaluated_team_id': data.get('evaluated_team_id'),
-            'evaluator_student_id': evaluator_id,
-            'team_comment': data.get('team_comment'),
-            'team_score': data.get('team_score'),
-            'created_at': get_est_now().isoformat()
+        supabase.rpc('replace_evaluation', {
+            'p_assignment_id': data.get('assignment_id'),
+            'p_evaluated_team_id': evaluated_team_id,
+            'p_evaluator_student_id': evaluator_id,
+            'p_team_comment': data.get('team_comment'),
+            'p_team_score': data.get('team_score'),
+            'p_member_evaluations': member_evaluations,
+            'p_created_at': get_est_now().isoformat()
         }).execute()
-        
-        # Store individual evaluations
-        for member_eval in data.get('member_evaluations', []):
-            # No longer skipping any students - all can be evaluated
-            student_id = member_eval.get('student_id')
-
-            supabase.table('member_evaluations').insert({
-                'team_evaluation_id': team_eval.data[0]['id'],
-                'evaluated_student_id': student_id,
-                'comment': member_eval.get('comment'),
-                'score': member_eval.get('score'),
-                'created_at': get_est_now().isoformat()
-            }).execute()
             
         return jsonify({'success': True})
+    except APIError as e:
+        if e.code == RAISE_EXCEPTION:
+            # Rejected by the evaluation rules trigger
+            return jsonify({'error': e.message}), 403
+        return jsonify({'error': str(e)}), 500
     except Exception as e:
-        return jsonify({'error': str(e)}), 500@app.route('/api/evaluations/check/<int:assignment_id>/<int:team_id>')
-@student_required
-def check_evaluation_exists(assignment_id, team_id):
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/evaluations/check/<int:assignment_id>')
+@role_required('student')
+def get_evaluated_teams(assignment_id):
     try:
-        # Check if evaluation exists for this student, assignment, and team
-        existing = supabase.table('team_evaluations').select('id').eq('assignment_id', assignment_id).eq('evaluated_team_id', team_id).eq('evaluator_student_id', session['user_id']).execute()
+        # Teams this student has already evaluated for the assignment, in one query
+        existing = supabase.table('team_evaluations').select('evaluated_team_id').eq('assignment_id', assignment_id).eq('evaluator_student_id', session['user_id']).execute()
         
-        exists = len(existing.data) > 0
-        return jsonify({'exists': exists})
+        return jsonify({'evaluated_team_ids': [row['evaluated_team_id'] for row in existing.data]})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/teacher/evaluations/<int:assignment_id>')
-@teacher_required
+@role_required('teacher')
 def get_all_evaluations(assignment_id):
     try:
-        # First get all team evaluations for this assignment
-        team_evals = supabase.table('team_evaluations').select('*').eq('assignment_id', assignment_id).execute()
-        
-        # For each team evaluation, fetch the related data
-        result = []
-        for team_eval in team_evals.data:
-            # Get evaluator student info
-            evaluator = supabase.table('students').select('id, name, team:teams(name)').eq('id', team_eval['evaluator_student_id']).single().execute()
-            
-            # Get evaluated team info
-            evaluated_team = supabase.table('teams').select('id, name').eq('id', team_eval['evaluated_team_id']).single().execute()
-            
-            # Get member evaluations
-            member_evals = supabase.table('member_evaluations').select('*').eq('team_evaluation_id', team_eval['id']).execute()
-            
-            # Enrich member evaluations with student names
-            for member_eval in member_evals.data:
-                student = supabase.table('students').select('id, name').eq('id', member_eval['evaluated_student_id']).single().execute()
-                member_eval['evaluated_student'] = student.data
-            
-            # Build the evaluation object
-            eval_obj = {
-                'id': team_eval['id'],
-                'assignment_id': team_eval['assignment_id'],
-                'evaluated_team_id': team_eval['evaluated_team_id'],
-                'evaluator_student_id': team_eval['evaluator_student_id'],
-                'team_comment': team_eval['team_comment'],
-                'team_score': team_eval['team_score'],
-                'created_at': team_eval['created_at'],
-                'evaluator': evaluator.data,
-                'evaluated_team': evaluated_team.data,
-                'member_evaluations': member_evals.data
-            }
-            result.append(eval_obj)
+        # Fetch team evaluations with evaluator, evaluated team and member evaluations
+        # embedded, so PostgREST resolves everything in a single joined query
+        team_evals = supabase.table('team_evaluations').select('''
+            id, assignment_id, evaluated_team_id, evaluator_student_id, team_comment, team_score, created_at,
+            evaluator:students!evaluator_student_id(id, name, team:teams(name)),
+            evaluated_team:teams!evaluated_team_id(id, name),
+            member_evaluations(*, evaluated_student:students!evaluated_student_id(id, name))
+        ''').eq('assignment_id', assignment_id).execute()
         
-        return jsonify({'evaluations': result})
+        return ojson_stream('evaluations', team_evals.data)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/teacher/report/<int:student_id>/<int:assignment_id>')
-@teacher_required
+@role_required('teacher')
 def generate_report(student_id, assignment_id):
     try:
+        # The student, assignment and member evaluations are independent,
+        # so fetch them concurrently on the shared pool
         # Get student info
-        student = supabase.table('students').select('*, team:teams(name), class:classes(name)').eq('id', student_id).single().execute()
+        student_future = executor.submit(lambda: supabase.table('students').select('id, name, student_id, team_id, class_id, team:teams(name), class:classes(name)').eq('id', student_id).single().execute())
         
         # Get assignment info
-        assignment = supabase.table('assignments').select('*').eq('id', assignment_id).single().execute()
+        assignment_future = executor.submit(lambda: supabase.table('assignments').select('*').eq('id', assignment_id).single().execute())
         
-        # Get team evaluations for student's team
+        # Get individual evaluations for this student
+        member_evals_future = executor.submit(lambda: supabase.table('member_evaluations').select('''
+            *,
+            team_evaluation:team_evaluations(evaluator:students!evaluator_student_id(name))
+        ''').eq('evaluated_student_id', student_id).execute())
+        
+        # Get team evaluations for student's team (needs the student's team_id)
+        student = student_future.result()
         team_evals = supabase.table('team_evaluations').select('''
             *,
             evaluator:students!evaluator_student_id(name)
         ''').eq('assignment_id', assignment_id).eq('evaluated_team_id', student.data['team_id']).execute()
         
-        # Get individual evaluations for this student
-        member_evals = supabase.table('member_evaluations').select('''
-            *,
-            team_evaluation:team_evaluations(evaluator:students!evaluator_student_id(name))
-        ''').eq('evaluated_student_id', student_id).execute()
+        assignment = assignment_future.result()
+        member_evals = member_evals_future.result()
         
         report = {
             'student': student.data,
@@ -1187,21 +1141,22 @@ def generate_report(student_id, assignment_id):
             'member_evaluations': member_evals.data
         }
         
-        return jsonify({'report': report})
+        return ojson({'report': report})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/classes/<int:class_id>/students/<int:student_id>', methods=['DELETE'])
-@teacher_required
+@role_required('teacher')
 def delete_student(class_id, student_id):
     try:
         # Get student info first
-        student_response = supabase.table('students').select('*').eq('id', student_id).execute()
+        student_response = supabase.table('students').select('id').eq('id', student_id).execute()
         if not student_response.data:
             return jsonify({'error': 'Student not found'}), 404
         
         # Delete the student
         supabase.table('students').delete().eq('id', student_id).execute()
+        bump_class_version(class_id)
         
         # No longer deleting teams when removing students
         # Teams can now exist with no members
@@ -1210,65 +1165,204 @@ def delete_student(class_id, student_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def get_unique_student_name(original_name, team_id):
-    """Helper to generate unique name like 'Name (2)' if duplicate exists in team"""
-    # Check if name already exists in this team
-    existing = supabase.table('students').select('id').eq('team_id', team_id).eq('name', original_name).execute()
+def cache_get(key):
+    """Read a JSON value from the Redis cache; Redis errors count as a miss"""
+    try:
+        cached = redis_client.get(key)
+    except redis.RedisError as e:
+        print(f"⚠️  Warning: Redis cache read failed: {e}")
+        return None
+    return json.loads(cached) if cached is not None else None
+
+def cache_set(key, ttl, value):
+    """Store a JSON value in the Redis cache for ttl seconds"""
+    try:
+        redis_client.setex(key, ttl, json.dumps(value))
+    except redis.RedisError as e:
+        print(f"⚠️  Warning: Redis cache write failed: {e}")
+
+def get_class_version(class_id):
+    """Version tag of a class's assignments and teams, or None if Redis is unavailable"""
+    key = f'class_version:{class_id}'
+    try:
+        version = redis_client.get(key)
+        if version is None:
+            # First read (or the key was lost): start from a fresh random version
+            redis_client.set(key, secrets.token_hex(8), nx=True, ex=CLASS_VERSION_TTL)
+            version = redis_client.get(key)
+    except redis.RedisError as e:
+        print(f"⚠️  Warning: Redis version read failed: {e}")
+        return None
+    return version.decode()
+
+def bump_class_version(class_id):
+    """Record that a class's assignments or teams changed, invalidating student ETags"""
+    try:
+        redis_client.setex(f'class_version:{class_id}', CLASS_VERSION_TTL, secrets.token_hex(8))
+    except redis.RedisError as e:
+        print(f"⚠️  Warning: Redis version bump failed: {e}")
+
+def class_etag(kind, class_id, *parts):
+    """ETag for a student view of class data; None disables conditional responses"""
+    version = get_class_version(class_id)
+    if version is None:
+        return None
+    return '-'.join(str(part) for part in (kind, class_id, version, *parts))
+
+def with_etag(response, etag):
+    """Attach an ETag so the browser revalidates instead of refetching"""
+    if etag is not None:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def ojson(obj, status=200):
+    """JSON response encoded with orjson, for large payloads"""
+    return app.response_class(orjson.dumps(obj), status=status, mimetype='application/json')
+
+def ojson_stream(key, rows):
+    """Stream {key: rows} as JSON, encoding one row at a time instead of the whole list"""
+    def generate():
+        yield b'{' + orjson.dumps(key) + b':['
+        for index, row in enumerate(rows):
+            yield (b',' if index else b'') + orjson.dumps(row)
+        yield b']}'
+    return app.response_class(generate(), mimetype='application/json')
+
+def get_access_token(token):
+    """Look up an access link token, cached in Redis until the link expires"""
+    cache_key = f'access_token:{token}'
+    token_data = cache_get(cache_key)
+    if token_data is not None:
+        return token_data
+    
+    token_response = supabase.table('access_tokens').select('*').eq('token', token).execute()
+    if not token_response.data:
+        return None
+    
+    token_data = token_response.data[0]
+    ttl = int(seconds_until(token_data['expires_at']))
+    if ttl > 0:
+        cache_set(cache_key, ttl, token_data)
+    return token_data
+
+def get_class_name(class_id):
+    """Look up a class name, cached in Redis"""
+    cache_key = f'class_name:{class_id}'
+    class_name = cache_get(cache_key)
+    if class_name is not None:
+        return class_name
     
-    if not existing.data:
-        return original_name
+    class_response = supabase.table('classes').select('name').eq('id', class_id).execute()
+    if not class_response.data:
+        return None
     
-    # Name exists, append " (2)", " (3)", etc.
+    class_name = class_response.data[0]['name']
+    cache_set(cache_key, CLASS_NAME_CACHE_TTL, class_name)
+    return class_name
+
+def verify_teacher_password(teacher, password):
+    """Check a teacher's password, upgrading legacy pbkdf2 hashes to argon2id"""
+    stored_hash = teacher['password']
+    if stored_hash.startswith('$argon2'):
+        try:
+            password_hasher.verify(stored_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+        needs_rehash = password_hasher.check_needs_rehash(stored_hash)
+    else:
+        if not check_password_hash(stored_hash, password):
+            return False
+        needs_rehash = True
+    
+    if needs_rehash:
+        try:
+            supabase.table('teachers').update({'password': password_hasher.hash(password)}).eq('id', teacher['id']).execute()
+        except Exception as e:
+            # The password was correct; the upgrade is retried on the next login
+            print(f"⚠️  Warning: Could not upgrade password hash for teacher {teacher['id']}: {e}")
+    return True
+
+def get_passcode_lookup(passcode):
+    """Keyed BLAKE2 digest of a passcode, used to skip pbkdf2 checks on rows that cannot match"""
+    if not PASSCODE_PEPPER:
+        return None
+    key = hashlib.sha256(PASSCODE_PEPPER.encode()).digest()
+    return hashlib.blake2s(passcode.encode(), key=key).hexdigest()
+
+def find_passcode_matches(students, passcode):
+    """Return the students whose stored passcode hash matches the given passcode"""
+    lookup = get_passcode_lookup(passcode)
+    matches = []
+    for student in students:
+        stored_lookup = student.get('passcode_lookup')
+        # A differing lookup digest means the passcode cannot match, so skip the pbkdf2 check
+        if lookup and stored_lookup and stored_lookup != lookup:
+            continue
+        if check_password_hash(student['passcode'], passcode):
+            if lookup and not stored_lookup:
+                # Backfill rows created before the lookup column existed
+                supabase.table('students').update({'passcode_lookup': lookup}).eq('id', student['id']).execute()
+            matches.append(student)
+    return matches
+
+def claim_device_token(student_id, device_token):
+    """Lock a student to a device unless another device got there first; returns the stored token"""
+    # Only succeeds while device_token is still empty, so concurrent logins cannot both claim it
+    response = supabase.table('students').update({'device_token': device_token}).eq('id', student_id).is_('device_token', 'null').execute()
+    if response.data:
+        return device_token
+    
+    winner = supabase.table('students').select('device_token').eq('id', student_id).single().execute()
+    return winner.data['device_token']
+
+def get_class_choices(students):
+    """Build the class selection list for a student enrolled in several classes"""
+    # Fetch all class names in one query instead of one per enrollment
+    class_ids = list({student['class_id'] for student in students})
+    class_rows = supabase.table('classes').select('id, name').in_('id', class_ids).execute().data
+    class_map = {c['id']: c['name'] for c in class_rows}
+    
+    return [{
+        'student_id': student['id'],
+        'class_id': student['class_id'],
+        'class_name': class_map[student['class_id']],
+        'team_id': student['team_id']
+    } for student in students if student['class_id'] in class_map]
+
+def get_unique_student_name(original_name, existing_names):
+    """Helper to generate unique name like 'Name (2)' if duplicate exists in team.
+    
+    existing_names is the set of names already in the team; the chosen name
+    is added to it so later names in the same batch see it too.
+    """
+    # Append " (2)", " (3)", etc. until the name is free
+    new_name = original_name
     counter = 2
-    while True:
+    while new_name in existing_names:
         new_name = f"{original_name} ({counter})"
-        existing = supabase.table('students').select('id').eq('team_id', team_id).eq('name', new_name).execute()
-        if not existing.data:
-            return new_name
         counter += 1
+    
+    existing_names.add(new_name)
+    return new_name
 
 def get_or_create_teacher_student_record(class_id, teacher_name):
     """
     Ensures a 'student' record exists for the teacher in the given class
     so they can submit evaluations.
     """
-    # 1. Check if "Teachers" team exists for this class
-    teachers_team_response = supabase.table('teams').select('*').eq('class_id', class_id).eq('name', 'Teachers').execute()
-    
-    if teachers_team_response.data:
-        teachers_team = teachers_team_response.data[0]
-    else:
-        # Create "Teachers" team
-        team_response = supabase.table('teams').insert({
-            'name': 'Teachers',
-            'class_id': class_id,
-            'created_at': get_est_now().isoformat()
-        }).execute()
-        teachers_team = team_response.data[0]
-    
-    # 2. Check if teacher student record exists
-    # We use a special student_id format: 'teacher-{teacher_id}' or just 'teacher' if generic
-    # But since we have teacher_name, let's use that to find them.
-    # Better: use session['user_id'] to make it unique if we had multiple teachers.
-    # For now, let's assume one teacher per class or just use name.
-    # Let's use student_id = 'teacher' for simplicity as requested.
-    
-    teacher_student_response = supabase.table('students').select('*').eq('team_id', teachers_team['id']).eq('name', teacher_name).execute()
-    
-    if teacher_student_response.data:
-        return teacher_student_response.data[0]
-    else:
-        # Create teacher student record
-        student_response = supabase.table('students').insert({
-            'name': teacher_name,
-            'student_id': 'teacher',
-            'passcode': generate_password_hash('teacher', method='pbkdf2'), # Dummy passcode
-            'team_id': teachers_team['id'],
-            'class_id': class_id,
-            'is_pre_added': False,
-            'created_at': get_est_now().isoformat()
-        }).execute()
-        return student_response.data[0]
+    # Upserts the "Teachers" team and the teacher's record in one call
+    # (see migrations/add_get_or_create_teacher_function.sql)
+    response = supabase.rpc('get_or_create_teacher', {
+        'p_class_id': class_id,
+        'p_teacher_name': teacher_name,
+        'p_passcode': TEACHER_RECORD_PASSCODE,
+        'p_created_at': get_est_now().isoformat()
+    }).execute()
+    return response.data[0]
+
+# Build the URL matcher now rather than on the first request
+app.url_map.update()
 
 if __name__ == '__main__':
     # Production: Vercel handles the server
@@ -0,0 +1,34 @@
+-- Finds or creates the "Teachers" team and the teacher's student record for a
+-- class in one round-trip, so teachers can submit evaluations.
+-- The teams upsert relies on teams_class_name_unique (add_teams_unique_name.sql).
+CREATE UNIQUE INDEX IF NOT EXISTS idx_students_teacher_record ON students (team_id, name) WHERE student_id = 'teacher';
+
+-- p_created_at is TIMESTAMP (without time zone) to match the created_at
+-- columns, so the app's EST wall-clock value is stored unchanged.
+DROP FUNCTION IF EXISTS get_or_create_teacher(BIGINT, TEXT, TEXT, TIMESTAMPTZ);
+
+CREATE OR REPLACE FUNCTION get_or_create_teacher(
+    p_class_id BIGINT,
+    p_teacher_name TEXT,
+    p_passcode TEXT,
+    p_created_at TIMESTAMP
+)
+RETURNS SETOF students
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    teachers_team_id BIGINT;
+BEGIN
+    -- The no-op DO UPDATE makes RETURNING yield the existing row on conflict
+    INSERT INTO teams (name, class_id, created_at)
+    VALUES ('Teachers', p_class_id, p_created_at)
+    ON CONFLICT ON CONSTRAINT teams_class_name_unique DO UPDATE SET name = EXCLUDED.name
+    RETURNING id INTO teachers_team_id;
+
+    RETURN QUERY
+    INSERT INTO students (name, student_id, passcode, team_id, class_id, is_pre_added, created_at)
+    VALUES (p_teacher_name, 'teacher', p_passcode, teachers_team_id, p_class_id, false, p_created_at)
+    ON CONFLICT (team_id, name) WHERE student_id = 'teacher' DO UPDATE SET name = EXCLUDED.name
+    RETURNING *;
+END;
+$$;
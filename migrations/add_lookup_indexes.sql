@@ -0,0 +1,8 @@
+-- Composite indexes for the lookups the app runs on every join, roster paste
+-- and evaluation submit. teams(class_id, name) is already covered by the
+-- teams_class_name_unique constraint (add_teams_unique_name.sql).
+CREATE INDEX IF NOT EXISTS idx_students_team_name ON students (team_id, name);
+CREATE INDEX IF NOT EXISTS idx_students_studentid_team_pre ON students (student_id, team_id) WHERE is_pre_added = true;
+CREATE INDEX IF NOT EXISTS idx_team_evals_lookup ON team_evaluations (assignment_id, evaluated_team_id, evaluator_student_id);
+CREATE INDEX IF NOT EXISTS idx_member_evals_teameval ON member_evaluations (team_evaluation_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_access_tokens_token ON access_tokens (token);
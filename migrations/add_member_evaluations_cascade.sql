@@ -0,0 +1,6 @@
+-- Deleting a team evaluation also deletes its member evaluations, so
+-- submit_evaluation can replace an evaluation with a single DELETE.
+ALTER TABLE member_evaluations
+    DROP CONSTRAINT IF EXISTS member_evaluations_team_evaluation_id_fkey,
+    ADD CONSTRAINT member_evaluations_team_evaluation_id_fkey
+        FOREIGN KEY (team_evaluation_id) REFERENCES team_evaluations(id) ON DELETE CASCADE;
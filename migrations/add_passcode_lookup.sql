@@ -0,0 +1,4 @@
+-- Keyed BLAKE2 digest of each student's passcode (see get_passcode_lookup in app.py).
+-- Login only runs the slow pbkdf2 check on rows whose digest matches.
+-- Existing rows are backfilled on their next successful login.
+ALTER TABLE students ADD COLUMN IF NOT EXISTS passcode_lookup TEXT;
@@ -0,0 +1,40 @@
+-- Replaces an evaluator's evaluation of a team in one transaction:
+-- the old team evaluation is deleted (its member evaluations cascade,
+-- see add_member_evaluations_cascade.sql) and the new rows are inserted.
+-- Called from submit_evaluation via supabase.rpc('replace_evaluation', ...).
+-- p_created_at is TIMESTAMP (without time zone) to match the created_at
+-- columns: the app's EST ISO string keeps its wall-clock value, exactly as
+-- when rows are inserted directly, instead of being shifted to UTC.
+DROP FUNCTION IF EXISTS replace_evaluation(BIGINT, BIGINT, BIGINT, TEXT, NUMERIC, JSONB, TIMESTAMPTZ);
+
+CREATE OR REPLACE FUNCTION replace_evaluation(
+    p_assignment_id BIGINT,
+    p_evaluated_team_id BIGINT,
+    p_evaluator_student_id BIGINT,
+    p_team_comment TEXT,
+    p_team_score NUMERIC,
+    p_member_evaluations JSONB,
+    p_created_at TIMESTAMP
+)
+RETURNS SETOF team_evaluations
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    new_eval team_evaluations;
+BEGIN
+    DELETE FROM team_evaluations
+    WHERE assignment_id = p_assignment_id
+      AND evaluated_team_id = p_evaluated_team_id
+      AND evaluator_student_id = p_evaluator_student_id;
+
+    INSERT INTO team_evaluations (assignment_id, evaluated_team_id, evaluator_student_id, team_comment, team_score, created_at)
+    VALUES (p_assignment_id, p_evaluated_team_id, p_evaluator_student_id, p_team_comment, p_team_score, p_created_at)
+    RETURNING * INTO new_eval;
+
+    INSERT INTO member_evaluations (team_evaluation_id, evaluated_student_id, comment, score, created_at)
+    SELECT new_eval.id, (m->>'student_id')::BIGINT, m->>'comment', (m->>'score')::NUMERIC, p_created_at
+    FROM jsonb_array_elements(COALESCE(p_member_evaluations, '[]'::JSONB)) AS m;
+
+    RETURN NEXT new_eval;
+END;
+$$;
@@ -0,0 +1,26 @@
+-- Enforces the evaluation rules on every insert into team_evaluations, so
+-- submit_evaluation does not need a lookup query before writing:
+--   * the Guests group cannot be evaluated
+--   * students cannot evaluate their own team
+-- Violations raise P0001, which the app returns as 403 with the message.
+CREATE OR REPLACE FUNCTION check_team_evaluation_rules()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF (SELECT name FROM teams WHERE id = NEW.evaluated_team_id) = 'Guests' THEN
+        RAISE EXCEPTION 'Cannot evaluate the Guests group';
+    END IF;
+
+    IF NEW.evaluated_team_id = (SELECT team_id FROM students WHERE id = NEW.evaluator_student_id) THEN
+        RAISE EXCEPTION 'You cannot evaluate your own team';
+    END IF;
+
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS team_evaluations_rules ON team_evaluations;
+CREATE TRIGGER team_evaluations_rules
+    BEFORE INSERT OR UPDATE ON team_evaluations
+    FOR EACH ROW EXECUTE FUNCTION check_team_evaluation_rules();
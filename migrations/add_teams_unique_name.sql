@@ -0,0 +1,4 @@
+-- Team names are unique within a class. manage_teams relies on this constraint
+-- to reject duplicates in the same round-trip as the insert.
+-- Rename or remove any existing duplicates before running this.
+ALTER TABLE teams ADD CONSTRAINT teams_class_name_unique UNIQUE (class_id, name);
@@ -180,6 +180,15 @@ async function startEvaluation(assignmentId) {
         return;
     }
     
+    // Load the teams already evaluated for this assignment once
+    try {
+        const result = await apiCall(`/api/evaluations/check/${assignmentId}`);
+        window.evaluatedTeamIds = new Set(result.evaluated_team_ids);
+    } catch (error) {
+        console.error('Failed to check evaluation status:', error);
+        window.evaluatedTeamIds = new Set();
+    }
+    
     renderEvaluationForm(assignment, evaluableTeams);
     openModal('evaluationModal');
 }
@@ -230,7 +239,7 @@ function renderEvaluationForm(assignment, evaluableTeams) {
     document.getElementById('submitEvaluationForm').addEventListener('submit', submitEvaluation);
 }
 
-async function updateMembersList() {
+function updateMembersList() {
     const teamId = parseInt(document.getElementById('teamToEvaluate').value);
     const evaluationContent = document.getElementById('evaluationContent');
     
@@ -246,31 +255,26 @@ async function updateMembersList() {
     }
     
     // Check if already evaluated
-    try {
-        const result = await apiCall(`/api/evaluations/check/${window.currentAssignmentId}/${teamId}`);
-        const warningDiv = document.getElementById('evaluationWarning');
-        
-        if (result.exists) {
-            if (!warningDiv) {
-                const div = document.createElement('div');
-                div.id = 'evaluationWarning';
-                div.className = 'alert alert-warning';
-                div.style.marginBottom = '20px';
-                div.style.padding = '10px';
-                div.style.backgroundColor = '#fff3cd';
-                div.style.border = '1px solid #ffeeba';
-                div.style.color = '#856404';
-                div.style.borderRadius = '4px';
-                div.innerHTML = '<strong>Note:</strong> You have already evaluated this team. Submitting a new evaluation will replace your previous one.';
-                evaluationContent.insertBefore(div, evaluationContent.firstChild);
-            } else {
-                warningDiv.style.display = 'block';
-            }
+    const warningDiv = document.getElementById('evaluationWarning');
+    
+    if (window.evaluatedTeamIds.has(teamId)) {
+        if (!warningDiv) {
+            const div = document.createElement('div');
+            div.id = 'evaluationWarning';
+            div.className = 'alert alert-warning';
+            div.style.marginBottom = '20px';
+            div.style.padding = '10px';
+            div.style.backgroundColor = '#fff3cd';
+            div.style.border = '1px solid #ffeeba';
+            div.style.color = '#856404';
+            div.style.borderRadius = '4px';
+            div.innerHTML = '<strong>Note:</strong> You have already evaluated this team. Submitting a new evaluation will replace your previous one.';
+            evaluationContent.insertBefore(div, evaluationContent.firstChild);
         } else {
-            if (warningDiv) warningDiv.style.display = 'none';
+            warningDiv.style.display = 'block';
         }
-    } catch (error) {
-        console.error('Failed to check evaluation status:', error);
+    } else {
+        if (warningDiv) warningDiv.style.display = 'none';
     }
     
     evaluationContent.style.display = 'block';